@@ -1,109 +1,442 @@
+import hashlib
+import re
 import threading
-import time
-from flask import Flask, render_template
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+from apscheduler.schedulers.background import BackgroundScheduler
+from flask import Flask, g, jsonify, render_template, request
+from flask_caching import Cache
+from flask_compress import Compress
 import os
+import numpy as np
+import orjson
 import pandas as pd
-import requests
-from datetime import datetime
-import matplotlib
-matplotlib.use('Agg')  # Use non-GUI backend for Render
-import matplotlib.pyplot as plt
+import requests_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from datetime import datetime, timedelta
+from pathlib import Path
 
 # Flask app
 app = Flask(__name__)
+app.config["SEND_FILE_MAX_AGE_DEFAULT"] = 300
+cache = Cache(app, config={"CACHE_TYPE": "SimpleCache", "CACHE_DEFAULT_TIMEOUT": 300})
+Compress(app)
 
 # Environment variables (set in Render dashboard)
 HEVY_API_KEY = os.getenv("HEVY_API_KEY")
 AUTO_REFRESH_INTERVAL = 1800  # 30 min
+RETRY_DELAY = 60  # first retry after a failed refresh, doubles each time
 
-# Cache for workouts
-cache_df = None
+# Exercise name keywords -> muscle group, first match wins
+MUSCLE_GROUPS = [
+    ("Chest/Shoulders", re.compile("bench|press", re.IGNORECASE)),
+    ("Back", re.compile("row|pulldown|pull ?up", re.IGNORECASE)),
+    ("Biceps", re.compile("curl", re.IGNORECASE)),
+    ("Quads", re.compile("extension|squat|lunge", re.IGNORECASE)),
+    ("Glutes/Hamstrings", re.compile("rdl|hip|deadlift", re.IGNORECASE)),
+    ("Calves", re.compile("calf", re.IGNORECASE))
+]
+BASE_URL = "https://api.hevyapp.com/v1"
+PAGE_SIZE = 10  # Hevy API maximum
+FETCH_WORKERS = 8
+
+# On-disk caches are keyed by API key so different accounts never mix
+CACHE_KEY = hashlib.sha256((HEVY_API_KEY or "").encode()).hexdigest()[:12]
+PARQUET_PATH = f"hevy_{CACHE_KEY}.parquet"
+CURSOR_PATH = f"hevy_{CACHE_KEY}.cursor"  # newest updated_at/deleted_at already synced
+SYNC_EPOCH = "1970-01-01T00:00:00Z"
+
+# Shared HTTP session so paged requests reuse one keep-alive connection.
+# Responses are cached in SQLite (per API key) and revalidated with conditional GETs.
+SESSION = requests_cache.CachedSession(
+    f"hevy_cache_{CACHE_KEY}",
+    backend="sqlite",
+    expire_after=timedelta(minutes=30),
+    cache_control=True,
+    stale_if_error=True,
+    ignored_parameters=["api-key"]  # keep the credential out of the on-disk cache
+)
+SESSION.headers.update({
+    "accept": "application/json",
+    "api-key": HEVY_API_KEY
+})
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=FETCH_WORKERS,
+    max_retries=Retry(total=3, backoff_factor=0.3)
+))
+
+# Code/template version, combined with the data hash in ETags so a deploy invalidates them
+APP_VERSION = hashlib.blake2b(
+    b"".join(Path(app.root_path, path).read_bytes()
+             for path in ("app.py", "templates/dashboard.html", "static/js/dashboard.js")),
+    digest_size=4
+).hexdigest()
+
+# Cached workouts and their data_hash (part of page cache keys and ETags), swapped
+# as one tuple so readers never pair a frame with another frame's hash
+cache_state = (None, None)
+
+# Serializes refresh_state so only one load reads/writes PARQUET_PATH at a time
+state_lock = threading.Lock()
+
+# Background refresh scheduler and consecutive failure count
+scheduler = BackgroundScheduler()
+refresh_failures = 0
 
 # ---------------------------
 # Fetch data from Hevy API
 # ---------------------------
-def fetch_workouts():
-    url = "https://api.hevyapp.com/v1/workouts?page=1&pageSize=10"
-    headers = {
-        "accept": "application/json",
-        "api-key": HEVY_API_KEY
-    }
-    r = requests.get(url, headers=headers)
+def fetch_page(endpoint, page, params=None):
+    r = SESSION.get(
+        f"{BASE_URL}/{endpoint}",
+        params={"page": page, "pageSize": PAGE_SIZE, **(params or {})},
+        timeout=10
+    )
 
     if r.status_code != 200:
-        print(f"[ERROR] API returned {r.status_code}: {r.text}")
+        print(f"[ERROR] API returned {r.status_code} for {endpoint} page {page}: {r.text}")
         return None
+    return orjson.loads(r.content)
 
-    data = r.json()
-    rows = []
+def fetch_all(endpoint, key, params=None):
+    # First page tells us how many pages there are
+    data = fetch_page(endpoint, 1, params)
+    if data is None:
+        return None
 
-    # Loop through workout items
-    for w in data.get("items", []):
-        try:
-            date = datetime.fromisoformat(w["start_time"].replace("Z", "+00:00")).date()
-        except Exception:
-            date = None
+    pages = [data]
+    page_count = data.get("page_count", 1)
+    if page_count > 1:
+        # Remaining pages are independent, so overlap their round trips
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as ex:
+            pages.extend(ex.map(
+                lambda page: fetch_page(endpoint, page, params),
+                range(2, page_count + 1)
+            ))
+        if any(p is None for p in pages):
+            return None
+
+    return [item for p in pages for item in p.get(key, [])]
+
+def fetch_workouts():
+    return fetch_all("workouts", "workouts")
+
+def fetch_workout_events(since):
+    # Workouts updated or deleted after `since`
+    return fetch_all("workouts/events", "events", {"since": since})
+
+# ---------------------------
+# Process workouts into a DataFrame
+# ---------------------------
+def process_workouts(workouts):
+    # First pass: count weighted sets so every column can be preallocated
+    n = sum(
+        1
+        for w in workouts
+        for ex in w.get("exercises", [])
+        for st in ex.get("sets", [])
+        if st.get("weight_kg") is not None
+    )
+    workout_idx = np.empty(n, dtype=np.int32)
+    exercise_codes = np.empty(n, dtype=np.int32)
+    weights = np.empty(n, dtype=np.float64)
+    reps = np.empty(n, dtype=np.int16)
+    exercise_names = {}
+
+    # Second pass: fill the typed columns; missing reps (timed sets) count as 0
+    i = 0
+    for wi, w in enumerate(workouts):
+        for ex in w.get("exercises", []):
+            code = exercise_names.setdefault(ex.get("title", "Unknown"), len(exercise_names))
+            for st in ex.get("sets", []):
+                if st.get("weight_kg") is None:
+                    continue
+                workout_idx[i] = wi
+                exercise_codes[i] = code
+                weights[i] = st["weight_kg"]
+                reps[i] = st.get("reps") or 0
+                i += 1
+
+    # Per-workout fields are parsed once and broadcast to their sets
+    ids = np.array([w["id"] for w in workouts], dtype=object)
+    updated = np.array([w.get("updated_at", "") for w in workouts], dtype=object)
+    starts = pd.to_datetime([w["start_time"] for w in workouts], utc=True, format="ISO8601")
+
+    df = pd.DataFrame({
+        "workout_id": ids[workout_idx],
+        "updated_at": updated[workout_idx],
+        "date": np.asarray(starts.date, dtype=object)[workout_idx],
+        "exercise": pd.Categorical.from_codes(exercise_codes, list(exercise_names)),
+        "weight": weights,
+        "reps": reps,
+        "volume": weights * reps
+    })
+    return df
+
+def read_saved_workouts():
+    try:
+        return pd.read_parquet(PARQUET_PATH)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"[WARN] Ignoring unreadable {PARQUET_PATH}: {e}")
+        return None
+
+def parse_time(ts):
+    try:
+        return datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+
+def event_workout_id(event):
+    return event["workout"]["id"] if "workout" in event else event.get("id")
+
+def event_timestamp(event):
+    if "workout" in event:
+        return event["workout"].get("updated_at")
+    return event.get("deleted_at")
+
+def event_time(event):
+    return parse_time(event_timestamp(event))
+
+def newest(timestamps):
+    parsed = [(parse_time(ts), ts) for ts in timestamps]
+    parsed = [(t, ts) for t, ts in parsed if t is not None]
+    return max(parsed)[1] if parsed else None
 
-        name = w.get("name", "Unknown")
-        volume = w.get("volume", 0)
-        rows.append({"date": date, "name": name, "volume": volume})
+def latest_events(events):
+    # One event per workout: the newest update or deletion wins (later in the feed on ties)
+    latest = {}
+    for e in events:
+        wid = event_workout_id(e)
+        t = event_time(e)
+        prev = latest.get(wid)
+        if prev is None or prev[0] is None or (t is not None and t >= prev[0]):
+            latest[wid] = (t, e)
+    return [e for _, e in latest.values()]
 
-    df = pd.DataFrame(rows)
+def read_sync_cursor():
+    try:
+        with open(CURSOR_PATH) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def load_workouts():
+    df = read_saved_workouts()
+    since = read_sync_cursor()
+    if df is not None and since is None and not df.empty:
+        # Saved before the cursor file existed
+        since = df["updated_at"].max()
+
+    if df is None or since is None:
+        # Cold start: page through the full history
+        workouts = fetch_workouts()
+        if workouts is None:
+            return None
+        df = process_workouts(workouts)
+        # Track every workout, including ones with no weighted sets (no rows in df)
+        cursor = newest(w.get("updated_at") for w in workouts) or SYNC_EPOCH
+    else:
+        # Only pull workouts changed since the last sync
+        events = fetch_workout_events(since=since)
+        if events:
+            # Drop events already applied in case the API treats since as inclusive
+            since_time = parse_time(since)
+            events = [e for e in events if since_time is None or event_time(e) is None or event_time(e) > since_time]
+        if not events:
+            # API unreachable or nothing changed; keep what we have
+            return df
+        cursor = newest([since] + [event_timestamp(e) for e in events]) or since
+
+        events = latest_events(events)
+        updated = [e["workout"] for e in events if e.get("type") == "updated"]
+        changed_ids = {event_workout_id(e) for e in events}
+        df = df[~df["workout_id"].isin(changed_ids)]
+        if updated:
+            df = pd.concat([df, process_workouts(updated)], ignore_index=True)
+            # Concatenating categoricals with different categories yields object
+            df["exercise"] = df["exercise"].astype("category")
+
+    # Write to a temp file and swap in so readers never see a partial file
+    tmp_path = f"hevy_{CACHE_KEY}.tmp.parquet"
+    df.to_parquet(tmp_path, compression="zstd")
+    os.replace(tmp_path, PARQUET_PATH)
+
+    # Cursor goes second, so a crash in between only replays events
+    with open(CURSOR_PATH + ".tmp", "w") as f:
+        f.write(cursor)
+    os.replace(CURSOR_PATH + ".tmp", CURSOR_PATH)
     return df
 
 # ---------------------------
-# Generate PNG charts
+# Build chart data (rendered client-side with Chart.js)
 # ---------------------------
-def generate_charts(df):
+def data_hash(obj):
+    hashed = pd.util.hash_pandas_object(obj).values.tobytes()
+    return hashlib.blake2b(hashed, digest_size=8).hexdigest()
+
+def weekly_volume(df):
+    # Bucket sets into Monday-start weeks and sum volume with one bincount
+    dates = pd.to_datetime(df["date"])
+    week_start = dates - pd.to_timedelta(dates.dt.weekday, unit="D")
+    codes, weeks = pd.factorize(week_start, sort=True)
+    totals = np.bincount(codes, weights=df["volume"].to_numpy(), minlength=len(weeks))
+    return pd.Series(totals, index=weeks)
+
+def create_volume_chart(volume_by_week):
+    return {
+        "labels": [d.date().isoformat() for d in volume_by_week.index],
+        "data": volume_by_week.round(1).tolist()
+    }
+
+def create_muscle_breakdown(volume_by_exercise):
+    # Classify each distinct exercise in one vectorized pass per muscle group
+    names = volume_by_exercise.index.to_series()
+    conds = [names.str.contains(pattern) for _, pattern in MUSCLE_GROUPS]
+    labels = [name for name, _ in MUSCLE_GROUPS] + ["Other"]
+    codes = np.select(conds, range(len(MUSCLE_GROUPS)), default=len(MUSCLE_GROUPS))
+
+    # Sum per group with bincount, keeping only groups that have exercises
+    totals = np.bincount(codes, weights=volume_by_exercise.to_numpy(), minlength=len(labels))
+    present = np.bincount(codes, minlength=len(labels)) > 0
+    muscle_map = pd.Series(totals, index=labels)[present].sort_values(ascending=False)
+
+    return {
+        "labels": muscle_map.index.tolist(),
+        "data": muscle_map.round(1).tolist()
+    }
+
+def build_charts(df):
     if df is None or df.empty:
-        return
-
-    # Sort by date
-    df = df.sort_values("date")
-
-    # Weekly volume trend
-    weekly = df.groupby("date")["volume"].sum()
-    plt.figure(figsize=(8, 4))
-    weekly.plot(kind="line", marker="o", title="Weekly Training Volume")
-    plt.xlabel("Date")
-    plt.ylabel("Volume")
-    plt.grid(True)
-    plt.tight_layout()
-    plt.savefig("static/weekly_trend.png")
-    plt.close()
+        return {}
+
+    return {
+        "volume": create_volume_chart(weekly_volume(df)),
+        "muscle": create_muscle_breakdown(df.groupby("exercise", observed=True)["volume"].sum())
+    }
 
 # ---------------------------
 # Auto refresh function
 # ---------------------------
+def set_state(df):
+    global cache_state
+    new_hash = data_hash(df)
+    changed = new_hash != cache_state[1]
+    # Publish first: a render still running on the old state can only be
+    # stored under the old hash's cache key, which no new request asks for
+    cache_state = (df, new_hash)
+    if changed:
+        cache.clear()
+
+def refresh_state(source, only_if_missing=False):
+    # Single loader for the refresh job and routes; errors are logged, not raised
+    with state_lock:
+        if only_if_missing and cache_state[0] is not None:
+            return cache_state[0]
+        try:
+            df = load_workouts()
+        except Exception as e:
+            print(f"[{source}] Failed: {e}")
+            return None
+        # An empty frame (no weighted sets yet) is valid state; only None is a failure
+        if df is not None:
+            set_state(df)
+        return df
+
 def auto_refresh_workouts():
-    global cache_df
-    while True:
-        print("[Auto-Refresh] Fetching latest workouts from Hevy API...")
-        df = fetch_workouts()
-        if df is not None and not df.empty:
-            cache_df = df
-            generate_charts(df)
-            print(f"[Auto-Refresh] Updated {len(df)} workouts at {datetime.now()}")
-        else:
-            print("[Auto-Refresh] No data fetched.")
-        time.sleep(AUTO_REFRESH_INTERVAL)
+    global refresh_failures
+    print("[Auto-Refresh] Fetching latest workouts from Hevy API...")
+    df = refresh_state("Auto-Refresh")
+
+    if df is not None:
+        refresh_failures = 0
+        print(f"[Auto-Refresh] Updated {len(df)} sets at {datetime.now()}")
+    else:
+        # Back off exponentially instead of waiting a full interval
+        refresh_failures += 1
+        delay = min(RETRY_DELAY * 2 ** (refresh_failures - 1), AUTO_REFRESH_INTERVAL)
+        scheduler.modify_job("auto_refresh", next_run_time=datetime.now() + timedelta(seconds=delay))
+        print(f"[Auto-Refresh] No data fetched, retrying in {delay}s.")
+
+def start_scheduler():
+    # One refresh at a time; late or missed runs collapse into a single run
+    scheduler.add_job(
+        auto_refresh_workouts,
+        "interval",
+        id="auto_refresh",
+        seconds=AUTO_REFRESH_INTERVAL,
+        jitter=60,
+        max_instances=1,
+        coalesce=True,
+        misfire_grace_time=AUTO_REFRESH_INTERVAL,
+        next_run_time=datetime.now()
+    )
+    scheduler.start()
+    atexit.register(lambda: scheduler.shutdown(wait=False))
 
 # ---------------------------
 # Flask routes
 # ---------------------------
+def get_state():
+    # Read once per request so the page, its cache key and its ETag describe the same data.
+    # Only the first request (before any refresh) loads data, and it waits on a
+    # refresh already in progress instead of starting another
+    if "state" not in g:
+        if cache_state[0] is None:
+            refresh_state("Dashboard", only_if_missing=True)
+        g.state = cache_state
+    return g.state[0]
+
+def page_cache_key():
+    get_state()
+    return f"view/{request.path}/{g.state[1]}"
+
 @app.route("/")
+@cache.cached(unless=lambda: cache_state[0] is None, make_cache_key=page_cache_key)
 def dashboard():
-    global cache_df
-    if cache_df is None:
-        df = fetch_workouts()
-        if df is not None:
-            cache_df = df
-            generate_charts(df)
-    return render_template("dashboard.html")
+    return render_template("dashboard.html", charts=build_charts(get_state()))
+
+@app.route("/pr_data")
+@cache.cached(unless=lambda: cache_state[0] is None, make_cache_key=page_cache_key)
+def get_pr_data():
+    df = get_state()
+    if df is None or df.empty:
+        return jsonify({})
+
+    # Heaviest set per exercise per day
+    top_sets = df.groupby(["exercise", "date"], observed=True)["weight"].max().round(2)
+    pr_data = {}
+    for (exercise, date), weight in top_sets.items():
+        pr_data.setdefault(exercise, []).append({"date": date.isoformat(), "weight": float(weight)})
+    return jsonify(pr_data)
+
+@app.after_request
+def add_cache_headers(response):
+    # Let browsers revalidate data-backed pages with If-None-Match instead of re-downloading
+    state_hash = g.get("state", (None, None))[1]
+    if request.endpoint not in ("dashboard", "get_pr_data") or state_hash is None:
+        return response
+    if response.status_code != 200:
+        return response
+
+    # Flask-Compress sends the ETag as "<hash>:<encoding>", so match on the hash part
+    current = f"{state_hash}-{APP_VERSION}"
+    etag = current
+    for tag in request.if_none_match.as_set():
+        if tag.split(":")[0] == current:
+            etag = tag
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "public, max-age=300, stale-while-revalidate=60"
+    return response.make_conditional(request)
 
 # ---------------------------
 # Main
 # ---------------------------
 if __name__ == "__main__":
-    threading.Thread(target=auto_refresh_workouts, daemon=True).start()
+    # Under the debug reloader only the child process (WERKZEUG_RUN_MAIN) serves requests
+    if not app.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_scheduler()
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
@@ -1,4 +1,38 @@
 document.addEventListener("DOMContentLoaded", async () => {
+    const charts = JSON.parse(document.getElementById("chartData").textContent);
+
+    if (charts.volume) {
+        new Chart(document.getElementById("volumeChart").getContext("2d"), {
+            type: "line",
+            data: {
+                labels: charts.volume.labels,
+                datasets: [{
+                    label: "Volume",
+                    data: charts.volume.data,
+                    borderColor: "blue",
+                    fill: false
+                }]
+            }
+        });
+    }
+
+    if (charts.muscle) {
+        new Chart(document.getElementById("muscleChart").getContext("2d"), {
+            type: "bar",
+            data: {
+                labels: charts.muscle.labels,
+                datasets: [{
+                    label: "Volume",
+                    data: charts.muscle.data,
+                    backgroundColor: "steelblue"
+                }]
+            },
+            options: {
+                indexAxis: "y"
+            }
+        });
+    }
+
     const res = await fetch("/pr_data");
     const data = await res.json();
 